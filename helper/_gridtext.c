@@ -0,0 +1,99 @@
+/*
+ * _gridtext.c — optional compiled renderer for img2grid.py.
+ *
+ * render(bw, on_bytes, off_bytes) -> bytes
+ *   bw: C-contiguous 2-D uint8 buffer (e.g. a NumPy array); pixels >= 128 are ON.
+ *   Emits on_bytes/off_bytes per pixel and '\n' after each row, exactly like grid_to_bytes.
+ *
+ * Build in place with:  python setup.py build_ext --inplace
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+
+static PyObject *
+render(PyObject *self, PyObject *args)
+{
+    PyObject *src_obj;
+    const char *on, *off;
+    Py_ssize_t on_len, off_len;
+    Py_buffer view;
+
+    if (!PyArg_ParseTuple(args, "Oy#y#:render", &src_obj, &on, &on_len, &off, &off_len))
+        return NULL;
+    if (PyObject_GetBuffer(src_obj, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0)
+        return NULL;
+    if (view.ndim != 2 || view.itemsize != 1 || (view.format && strcmp(view.format, "B") != 0)) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "render: expected a C-contiguous 2-D uint8 array");
+        return NULL;
+    }
+
+    const Py_ssize_t H = view.shape[0], W = view.shape[1];
+    const Py_ssize_t max_len = on_len > off_len ? on_len : off_len;
+    /* Worst case: every pixel uses the longer character, plus one newline per row. */
+    if (H > 0 && (W > (PY_SSIZE_T_MAX / H - 1) / (max_len > 0 ? max_len : 1))) {
+        PyBuffer_Release(&view);
+        return PyErr_NoMemory();
+    }
+    const Py_ssize_t upper = H * (W * max_len + 1);
+
+    PyObject *out = PyBytes_FromStringAndSize(NULL, upper);
+    if (out == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    char *dst = PyBytes_AS_STRING(out);
+    const unsigned char *src = (const unsigned char *)view.buf;
+    Py_ssize_t p = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (on_len == 1 && off_len == 1) {
+        const char on_c = on[0], off_c = off[0];
+        for (Py_ssize_t i = 0; i < H; i++) {
+            const unsigned char *row = src + i * W;
+            for (Py_ssize_t j = 0; j < W; j++)
+                dst[p++] = row[j] >= 128 ? on_c : off_c;
+            dst[p++] = '\n';
+        }
+    }
+    else {
+        for (Py_ssize_t i = 0; i < H; i++) {
+            const unsigned char *row = src + i * W;
+            for (Py_ssize_t j = 0; j < W; j++) {
+                if (row[j] >= 128) {
+                    memcpy(dst + p, on, on_len);
+                    p += on_len;
+                }
+                else {
+                    memcpy(dst + p, off, off_len);
+                    p += off_len;
+                }
+            }
+            dst[p++] = '\n';
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    if (p != upper && _PyBytes_Resize(&out, p) < 0)
+        return NULL;
+    return out;
+}
+
+static PyMethodDef gridtext_methods[] = {
+    {"render", render, METH_VARARGS,
+     "render(bw, on_bytes, off_bytes) -> bytes\n\n"
+     "Render a 2-D uint8 image (>= 128 is ON) as newline-terminated rows of on/off bytes."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef gridtext_module = {
+    PyModuleDef_HEAD_INIT, "_gridtext", "Compiled text-grid renderer for img2grid.py.", -1, gridtext_methods
+};
+
+PyMODINIT_FUNC
+PyInit__gridtext(void)
+{
+    return PyModule_Create(&gridtext_module);
+}
@@ -5,11 +5,13 @@ img2grid.py — Convert an image to a binary text grid using two characters (def
 Output is H*W characters per line (W columns), with newline-separated rows (H rows).
 Designed for high-contrast, sharp boundaries, and tunable morphological smoothing.
 
-Dependencies: numpy, opencv-python
+Dependencies: numpy, opencv-python (optional: numba, or the _gridtext C extension from setup.py)
 """
 
 import argparse
 import sys
+import threading
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 
@@ -19,9 +21,27 @@ except ImportError as e:
     print("Missing dependency: opencv-python. Install via: pip install opencv-python", file=sys.stderr)
     raise
 
+try:
+    import _gridtext  # optional C renderer, see setup.py
+except ImportError:
+    _gridtext = None
+
 # -----------------------------
 # Helpers
 # -----------------------------
+# User-friendly aliases accepted by parse_char
+_CHAR_ALIASES = {
+    'space': ' ',
+    'tab': '\t',
+    'nbspace': '\xa0',  # non-breaking space
+    'emspace': '\u2003',
+    'enspace': '\u2002',
+    'thinspace': '\u2009',
+    'figspace': '\u2007',
+    'mspace': '\u2003',
+    'zwnbsp': '\ufeff',  # zero width no-break space (be careful)
+}
+
 def parse_char(s: str) -> str:
     """
     Parse a CLI-supplied character, supporting common escape sequences like '\\t', '\\n', '\\u2003'.
@@ -29,20 +49,12 @@ def parse_char(s: str) -> str:
     """
     if s is None:
         return ' '
-    # Allow user-friendly aliases
-    aliases = {
-        'space': ' ',
-        'tab': '\t',
-        'nbspace': '\xa0',  # non-breaking space
-        'emspace': '\u2003',
-        'enspace': '\u2002',
-        'thinspace': '\u2009',
-        'figspace': '\u2007',
-        'mspace': '\u2003',
-        'zwnbsp': '\ufeff',  # zero width no-break space (be careful)
-    }
-    if s.lower() in aliases:
-        ch = aliases[s.lower()]
+    # A single literal character needs no alias lookup or escape decoding
+    if len(s) == 1:
+        return s
+    alias = _CHAR_ALIASES.get(s.lower())
+    if alias is not None:
+        ch = alias
     else:
         # Interpret Python-style escapes
         ch = bytes(s, 'utf-8').decode('unicode_escape')
@@ -55,12 +67,10 @@ def parse_char(s: str) -> str:
 
 def oddize(n: int, minimum: int = 3) -> int:
     """Ensure n is odd and >= minimum."""
-    n = int(round(n))
+    n = int(n)
     if n < minimum:
         n = minimum
-    if n % 2 == 0:
-        n += 1
-    return n
+    return n | 1
 
 def compute_target_size(h, w, width=None, height=None, scale=None, y_aspect=0.5):
     """
@@ -103,14 +113,45 @@ def compute_target_size(h, w, width=None, height=None, scale=None, y_aspect=0.5)
 
     return h, w
 
+# CLAHE objects keyed by (clip, grid), reused across calls when this module is imported for batch use.
+# Per thread: cv2.CLAHE keeps internal scratch buffers, so one object must not be shared across threads.
+_CLAHE_LOCAL = threading.local()
+
 def apply_contrast_enhancement(gray, clahe_clip=2.0, clahe_grid=8):
     """Contrast enhancement via CLAHE."""
-    clahe = cv2.createCLAHE(clipLimit=float(clahe_clip), tileGridSize=(int(clahe_grid), int(clahe_grid)))
+    cache = getattr(_CLAHE_LOCAL, 'cache', None)
+    if cache is None:
+        cache = _CLAHE_LOCAL.cache = {}
+    key = (float(clahe_clip), int(clahe_grid))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=(key[1], key[1]))
     return clahe.apply(gray)
 
-def binarize(gray, method='otsu', adaptive_block=31, adaptive_c=5, canny_lo=100, canny_hi=200):
+def apply_contrast_stretch(gray, lo_pct=2.0, hi_pct=98.0):
+    """Contrast stretch mapping the lo/hi percentiles to 0/255 through a single 256-entry LUT."""
+    host = gray.get() if isinstance(gray, cv2.UMat) else gray
+    cdf = np.cumsum(np.bincount(host.ravel(), minlength=256))
+    lo, hi = np.searchsorted(cdf, [cdf[-1] * lo_pct / 100.0, cdf[-1] * hi_pct / 100.0])
+    lut = np.clip(np.rint((np.arange(256) - lo) * 255.0 / max(hi - lo, 1)), 0, 255).astype(np.uint8)
+    return cv2.LUT(gray, lut)
+
+# Above this many pixels, Otsu's threshold is estimated from a random subsample (unless disabled)
+_FAST_OTSU_PIXELS = 4_000_000
+_FAST_OTSU_SAMPLES = 50_000
+
+def binarize(gray, method='otsu', adaptive_block=31, adaptive_c=5, canny_lo=100, canny_hi=200,
+             fast_otsu=None):
     method = method.lower()
     if method == 'otsu':
+        # fast_otsu: True forces, False disables, None enables automatically for huge images
+        # (not for cv2.UMat input: the full histogram is already computed on the device there)
+        if isinstance(gray, np.ndarray) and (fast_otsu or (fast_otsu is None and gray.size > _FAST_OTSU_PIXELS)):
+            # Fixed seed keeps the output reproducible between runs
+            idx = np.random.default_rng(0).integers(0, gray.size, _FAST_OTSU_SAMPLES)
+            t, _ = cv2.threshold(gray.ravel()[idx], 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            _t, bw = cv2.threshold(gray, t, 255, cv2.THRESH_BINARY)
+            return bw
         _t, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         return bw
     if method == 'adaptive_mean':
@@ -127,42 +168,134 @@ def binarize(gray, method='otsu', adaptive_block=31, adaptive_c=5, canny_lo=100,
         return edges
     raise ValueError(f"Unknown method: {method}")
 
-def apply_morph(bw, morph='none', ksize=3, iterations=1):
+# Rectangular structuring elements keyed by kernel size
+_MORPH_KERNELS = {}
+
+def apply_morph(bw, morph='none', ksize=3, iterations=1, dst=None):
+    """Morphological smoothing of a binary image. Pass dst=bw to operate in place (bw is then overwritten)."""
     morph = morph.lower()
     if morph == 'none' or iterations <= 0:
         return bw
     k = oddize(ksize, minimum=1)
-    kernel = np.ones((k, k), np.uint8)
+    kernel = _MORPH_KERNELS.get(k)
+    if kernel is None:
+        kernel = _MORPH_KERNELS[k] = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
     if morph == 'open':
-        return cv2.morphologyEx(bw, cv2.MORPH_OPEN, kernel, iterations=iterations)
+        return cv2.morphologyEx(bw, cv2.MORPH_OPEN, kernel, dst=dst, iterations=iterations)
     if morph == 'close':
-        return cv2.morphologyEx(bw, cv2.MORPH_CLOSE, kernel, iterations=iterations)
+        return cv2.morphologyEx(bw, cv2.MORPH_CLOSE, kernel, dst=dst, iterations=iterations)
     if morph == 'erode':
-        return cv2.erode(bw, kernel, iterations=iterations)
+        return cv2.erode(bw, kernel, dst=dst, iterations=iterations)
     if morph == 'dilate':
-        return cv2.dilate(bw, kernel, iterations=iterations)
+        return cv2.dilate(bw, kernel, dst=dst, iterations=iterations)
     return bw
 
-def grid_to_text(bw, on_char='0', off_char=' '):
+# Below this many pixels the numba import/JIT/thread-pool startup outweighs the faster render loop
+_NUMBA_MIN_PIXELS = 4_000_000
+
+@lru_cache(maxsize=None)
+def _numba_emit():
+    """
+    Build the numba row-parallel grid kernel on first use; None when numba is not installed.
+    Imported lazily: numba costs ~0.3 s at import and is only needed for multi-byte characters.
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(parallel=True, cache=True)
+    def _emit(bw_bin, on_bytes, off_bytes, on_len, off_len, offsets, out):
+        """Write the UTF-8 grid into preallocated `out`; row i starts at offsets[i], so rows run in parallel."""
+        H, W = bw_bin.shape
+        for i in prange(H):
+            p = offsets[i]
+            for j in range(W):
+                if bw_bin[i, j]:
+                    for k in range(on_len):
+                        out[p] = on_bytes[k]
+                        p += 1
+                else:
+                    for k in range(off_len):
+                        out[p] = off_bytes[k]
+                        p += 1
+            out[p] = 10  # newline
+
+    return _emit
+
+def grid_to_bytes(bw, on_char='0', off_char=' ', already_binary=False, use_numba=None):
     """
     Map 255 -> on_char, 0 -> off_char. Ensure values are exactly 0/255 (for robustness, threshold at 128).
+    Returns the UTF-8 encoded grid, one newline-terminated line per row.
+    Pass already_binary=True for uint8 0/255 input (binarize/apply_morph output) to skip the compare.
+    use_numba: None picks the numba kernel for multi-byte chars only at >= _NUMBA_MIN_PIXELS.
     """
     H, W = bw.shape
-    # Ensure binary
-    binarized = (bw >= 128).astype(np.uint8)
-    # Build lines efficiently
+    bw = np.ascontiguousarray(bw)
+    if _gridtext is not None and bw.dtype == np.uint8:
+        # Compiled renderer: thresholds at 128 and copies the char bytes in a single pass
+        return _gridtext.render(bw, on_char.encode('utf-8'), off_char.encode('utf-8'))
+    # Index through the flat 1-D view (cheaper fancy indexing than 2-D); reshape is free
+    flat = bw.ravel()
+    if already_binary:
+        # 0/255 -> 0/1 via the top bit
+        flat_bin = np.right_shift(flat, 7)
+    else:
+        # Ensure binary; reinterpret the bool mask as 0/1 bytes rather than copying it
+        flat_bin = (flat >= 128).view(np.uint8)
+    binarized = flat_bin.reshape(H, W)
     on_byte = on_char.encode('utf-8')
     off_byte = off_char.encode('utf-8')
-    # We'll create a bytes buffer for speed, then decode once at the end
-    out = bytearray()
-    for r in range(H):
-        row = binarized[r]
-        # Build row bytes
-        out.extend(on_byte if row[0] else off_byte)
-        for c in row[1:]:
-            out.extend(on_byte if c else off_byte)
-        out.append(0x0A)  # newline
-    return out.decode('utf-8', errors='strict')
+    if len(on_byte) == 1 and len(off_byte) == 1:
+        # ASCII fast path: one vectorized gather through a 2-entry byte LUT, plus a newline column
+        lut = np.frombuffer(off_byte + on_byte, dtype=np.uint8)
+        out = np.empty((H, W + 1), dtype=np.uint8)
+        out[:, :W] = lut[flat_bin].reshape(H, W)
+        out[:, W] = 0x0A  # newline
+        return out.tobytes()
+    if use_numba is None:
+        use_numba = H * W >= _NUMBA_MIN_PIXELS
+    emit = _numba_emit() if use_numba else None
+    if emit is not None:
+        # Multi-byte chars: compiled row-parallel loop emitting UTF-8 into an exactly sized buffer
+        on_bytes = np.frombuffer(on_byte, dtype=np.uint8)
+        off_bytes = np.frombuffer(off_byte, dtype=np.uint8)
+        on_counts = binarized.sum(axis=1, dtype=np.int64)
+        row_lens = on_counts * len(on_byte) + (W - on_counts) * len(off_byte) + 1
+        offsets = np.zeros(H, dtype=np.int64)
+        np.cumsum(row_lens[:-1], out=offsets[1:])
+        out = np.empty(int(row_lens.sum()), dtype=np.uint8)
+        emit(binarized, on_bytes, off_bytes, len(on_byte), len(off_byte), offsets, out)
+        return out.tobytes()
+    if len(on_char) != 1 or len(off_char) != 1:
+        # Multi-codepoint strings (library use; the CLI enforces one char): plain per-row byte join
+        cells = (off_byte, on_byte)
+        return b''.join(b''.join([cells[v] for v in row]) + b'\n' for row in binarized.tolist())
+    # Single codepoints: gather fixed-width UTF-32 and transcode once
+    lut = np.array([ord(off_char), ord(on_char)], dtype='<u4')
+    out = np.empty((H, W + 1), dtype='<u4')
+    out[:, :W] = lut[flat_bin].reshape(H, W)
+    out[:, W] = 0x0A  # newline
+    return out.tobytes().decode('utf-32-le').encode('utf-8')
+
+def grid_to_text(bw, on_char='0', off_char=' ', already_binary=False):
+    """Same as grid_to_bytes, decoded to str."""
+    return grid_to_bytes(bw, on_char=on_char, off_char=off_char,
+                         already_binary=already_binary).decode('utf-8')
+
+def write_grid(bw, path, on_char='0', off_char=' ', already_binary=False, chunk_pixels=1 << 20):
+    """
+    Stream the grid to `path` in row blocks of ~chunk_pixels, so peak memory stays bounded
+    regardless of image size (same bytes as grid_to_bytes on the whole image).
+    """
+    H, W = bw.shape
+    rows = max(1, chunk_pixels // max(W, 1))
+    # Decide on numba for the whole image, not per block, so big grids still get the compiled path
+    use_numba = H * W >= _NUMBA_MIN_PIXELS
+    with open(path, 'wb') as f:
+        for r in range(0, H, rows):
+            f.write(grid_to_bytes(bw[r:r + rows], on_char=on_char, off_char=off_char,
+                                  already_binary=already_binary, use_numba=use_numba))
 
 def main():
     ap = argparse.ArgumentParser(
@@ -177,9 +310,12 @@ def main():
     ap.add_argument("--y-aspect", type=float, default=0.5,
                     help="Vertical compression factor to compensate glyph aspect ratio (default: 0.5).")
     # Preprocess
-    ap.add_argument("--clahe", action="store_true", help="Enable CLAHE contrast enhancement.")
+    contrast = ap.add_mutually_exclusive_group()
+    contrast.add_argument("--clahe", action="store_true", help="Enable CLAHE contrast enhancement.")
     ap.add_argument("--clahe-clip", type=float, default=2.0, help="CLAHE clip limit (default 2.0).")
     ap.add_argument("--clahe-grid", type=int, default=8, help="CLAHE tile grid size (default 8).")
+    contrast.add_argument("--simple-contrast", action="store_true",
+                          help="Use a cheap 2-98%% percentile contrast stretch instead of CLAHE.")
     ap.add_argument("--blur", type=int, default=0,
                     help="Gaussian blur kernel (odd). 0 disables. Helps denoise before thresholding.")
     # Binarization
@@ -187,6 +323,10 @@ def main():
                     default="otsu", help="Binarization method (default: otsu).")
     ap.add_argument("--adaptive-block", type=int, default=31, help="Adaptive threshold block size (odd).")
     ap.add_argument("--adaptive-c", type=int, default=5, help="Adaptive threshold fine-tuning constant.")
+    ap.add_argument("--fast-otsu", action=argparse.BooleanOptionalAction, default=None,
+                    help="Estimate the Otsu threshold from a pixel subsample (default: automatic above "
+                         f"{_FAST_OTSU_PIXELS // 1_000_000}M pixels; --no-fast-otsu forces the exact threshold). "
+                         "Not applied with --opencl.")
     ap.add_argument("--canny-lo", type=int, default=100, help="Canny lower threshold.")
     ap.add_argument("--canny-hi", type=int, default=200, help="Canny upper threshold.")
     # Morphology & tuning
@@ -203,6 +343,9 @@ def main():
                     help=r"Character for OFF pixels (default space). Supports escapes like '\t' or '\u2003'.")
     ap.add_argument("--whitespace-only", action="store_true",
                     help="Use only whitespace characters: ON=tab, OFF=space. Warning: visualization may be tricky.")
+    # Acceleration
+    ap.add_argument("--opencl", action="store_true",
+                    help="Run resize/contrast/blur/threshold/morphology on the GPU via OpenCV's OpenCL T-API.")
     # Optional preview
     ap.add_argument("--save-preview", metavar="PNG_PATH",
                     help="Save the processed binary image as a PNG for sanity-checking.")
@@ -215,34 +358,51 @@ def main():
 
     out_path = Path(args.output) if args.output else in_path.with_suffix(".txt")
 
-    # Read and grayscale
-    img = cv2.imread(str(in_path), cv2.IMREAD_COLOR)
-    if img is None:
+    # Read straight to grayscale (decoders skip chroma work; downstream only needs luma)
+    gray = cv2.imread(str(in_path), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
         print(f"Failed to read image: {in_path}", file=sys.stderr)
         sys.exit(2)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     # Size
     h, w = gray.shape
     th, tw = compute_target_size(h, w, args.width, args.height, args.scale, args.y_aspect)
+
+    # Optionally keep the image pipeline on the OpenCL device until the grid is rendered
+    if args.opencl:
+        if cv2.ocl.haveOpenCL():
+            cv2.ocl.setUseOpenCL(True)
+            gray = cv2.UMat(gray)
+        else:
+            print("OpenCL not available; continuing on the CPU.", file=sys.stderr)
+
     if th != h or tw != w:
-        gray = cv2.resize(gray, (tw, th), interpolation=cv2.INTER_AREA)
+        # INTER_AREA only pays off when shrinking; bilinear is faster (and sharper) for upscales
+        interp = cv2.INTER_AREA if (th * tw) <= (h * w) else cv2.INTER_LINEAR
+        gray = cv2.resize(gray, (tw, th), interpolation=interp)
 
     # Contrast / denoise
-    if args.clahe:
+    if args.simple_contrast:
+        gray = apply_contrast_stretch(gray)
+    elif args.clahe:
         gray = apply_contrast_enhancement(gray, args.clahe_clip, args.clahe_grid)
     if args.blur and args.blur > 0:
         k = oddize(args.blur, 1)
         gray = cv2.GaussianBlur(gray, (k, k), 0)
 
     # Binarize
+    if args.fast_otsu and isinstance(gray, cv2.UMat):
+        print("--fast-otsu is ignored with --opencl; using the exact Otsu threshold.", file=sys.stderr)
     bw = binarize(gray, method=args.method, adaptive_block=args.adaptive_block,
-                  adaptive_c=args.adaptive_c, canny_lo=args.canny_lo, canny_hi=args.canny_hi)
+                  adaptive_c=args.adaptive_c, canny_lo=args.canny_lo, canny_hi=args.canny_hi,
+                  fast_otsu=args.fast_otsu)
 
     # Post-process
-    bw = apply_morph(bw, morph=args.morph, ksize=args.morph_ksize, iterations=args.morph_iters)
-    if args.invert:
-        bw = 255 - bw
+    if args.morph != "none" and args.morph_iters > 0:
+        # In place: bw is ours, so skip allocating another full-size image
+        bw = apply_morph(bw, morph=args.morph, ksize=args.morph_ksize, iterations=args.morph_iters, dst=bw)
+    if isinstance(bw, cv2.UMat):
+        bw = bw.get()  # back to host memory for rendering
 
     # Characters
     on_char = '\t' if args.whitespace_only else args.on_char
@@ -250,10 +410,12 @@ def main():
     if len(on_char) != 1 or len(off_char) != 1:
         print("Error: on-char and off-char must be single characters.", file=sys.stderr)
         sys.exit(3)
+    # Polarity: swapping the characters is equivalent to inverting bw, without another full-image pass
+    if args.invert:
+        on_char, off_char = off_char, on_char
 
-    # Build text and save
-    text = grid_to_text(bw, on_char=on_char, off_char=off_char)
-    out_path.write_text(text, encoding='utf-8')
+    # Build text and save, streamed in row blocks (binarize/apply_morph guarantee 0/255 uint8)
+    write_grid(bw, out_path, on_char=on_char, off_char=off_char, already_binary=True)
     print(f"Wrote text grid: {out_path}  (shape: {bw.shape[0]}x{bw.shape[1]})")
 
     # Optional preview image
@@ -262,6 +424,8 @@ def main():
         # Ensure binary 0/255 PNG
         if bw.dtype != np.uint8:
             bw = (bw > 0).astype(np.uint8) * 255
+        if args.invert:
+            bw = cv2.bitwise_not(bw)
         ok = cv2.imwrite(args.save_preview, bw)
         if ok:
             print(f"Saved preview PNG: {args.save_preview}")
@@ -0,0 +1,12 @@
+"""
+Builds the optional _gridtext C renderer used by img2grid.py (falls back to NumPy/numba without it):
+
+    python setup.py build_ext --inplace
+"""
+
+from setuptools import Extension, setup
+
+setup(
+    name="img2grid-gridtext",
+    ext_modules=[Extension("_gridtext", ["_gridtext.c"])],
+)
@@ -0,0 +1,20 @@
+"""Regression checks for img2grid.py. Run from this directory: python -m pytest -q"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import img2grid
+
+
+def test_clahe_cache_is_thread_safe():
+    # Batch drivers may call apply_contrast_enhancement from several threads at once
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (64 + 37 * i, 80 + 53 * i), dtype=np.uint8) for i in range(64)]
+    expected = [cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(g) for g in images]
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        for _ in range(3):
+            results = list(ex.map(lambda g: img2grid.apply_contrast_enhancement(g, 2.0, 8), images))
+            for got, want in zip(results, expected):
+                assert np.array_equal(got, want)